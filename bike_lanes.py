@@ -9,10 +9,10 @@ I manually post-edited with a title, legend, and other information.
 © 2023 Matt Post
 """
 
-import math
 import osmnx as ox
 import geopandas as gpd
 import matplotlib.pyplot as plt
+import matplotlib.patheffects as pe
 
 from common import *
 
@@ -26,13 +26,6 @@ def main(args):
     place = "Baltimore, MD"
     placename = place.split(',')[0].replace(" ", "").lower()
 
-    # for the north/south adjustments, we need to take into account the
-    # curvature of the earth. Here we find how much we need to add to the Y
-    # access, using the mid-latitude point as an approximation.
-    # return the distance between two longitude coordinates at a given latitude
-    def lon_distance(lon1, lon2, lat):
-        return (lon2 - lon1) * math.cos(lat * math.pi / 180)
-
     print(ox.settings.default_crs)
 
     city = ox.geocode_to_gdf(place)
@@ -43,16 +36,20 @@ def main(args):
     # Using a network type of "all_private" will get all the alleys etc
     # It also makes the boundaries with water a lot fuzzier since they
     # are overlaid.
-    G = ox.graph_from_place(place, network_type="drive", retain_all=True)
+    # We already have the geocoded boundary above; querying by polygon
+    # skips the second Nominatim lookup graph_from_place would make.
+    G = ox.graph_from_polygon(city.geometry.iloc[0], network_type="drive", retain_all=False)
 
     # Convert to a GeoDataFrame and project to a common CRS
     gdf_streets = ox.graph_to_gdfs(G, nodes=False, edges=True, node_geometry=False, fill_edge_geometry=True)
-    gdf_streets = gdf_streets.to_crs(common_crs)
+    # only the geometry is drawn; shed the OSM attribute columns
+    gdf_streets = align_crs(gdf_streets[["geometry"]], common_crs)
     print("IS PROJECTED streets?", gdf_streets.crs.is_projected)
 
 
     # get the bounds of the city
     west, south, east, north = gdf_streets.total_bounds
+    one_mile = one_mile_at(north, south)
 
     tags = {"highway": "cycleway", "route": "bicycle"}
     # tags = {"network": "lcn", "route": "bicycle"}
@@ -93,8 +90,11 @@ def main(args):
     # plot the streets, neighborhoods, water, parks, and cemeteries
     city.plot(ax=ax, fc="white", ec="black", linewidth=1, alpha=1)
     gdf_streets.plot(ax=ax, fc="none", ec="#666666", linewidth=1, alpha=0.5)
-    gdf_bikepaths.plot(ax=ax, fc="none", ec="orange", linewidth=3, alpha=0.3)
-    gdf_bikepaths.plot(ax=ax, fc="none", ec="orange", linewidth=0.5, alpha=1)
+    # one plot call with a stroke effect gives the same glow as the old
+    # wide-translucent + thin-solid double plot, but the paths are built
+    # and written to the PDF once
+    gdf_bikepaths.plot(ax=ax, fc="none", ec="orange", linewidth=0.5, alpha=1,
+                       path_effects=[pe.Stroke(linewidth=3, foreground="orange", alpha=0.3), pe.Normal()])
     # gdf_ghost.plot(ax=ax, marker="X", markersize=50, color=ghost_color, alpha=1)
 
     fig.savefig(f"{placename}.pdf", dpi=300, pad_inches=1.0)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-import random
+import numpy as np
 import osmnx as ox
+import networkx as nx
 import matplotlib.pyplot as plt
 
+from concurrent.futures import ThreadPoolExecutor
+
 from common import *
 
 
@@ -13,12 +16,67 @@ ox.settings.use_cache = True
 print(ox.__version__)
 
 
+# Shared style for the neighborhood labels, hoisted out of the label loop
+# so each call doesn't rebuild the kwargs dict.
+LABEL_KW = dict(
+    horizontalalignment="center",
+    verticalalignment="center",
+    fontsize=6,
+    color="#666666",
+    weight="bold",
+    name="Helvetica",
+    # name="Phosphate",
+    zorder=20,
+)
+
+
 def get_bounds(place):
     gdf = ox.geocode_to_gdf(place)
     bounds = gdf.total_bounds
     return bounds
 
 
+def assign_colors(G, n_colors):
+    """Greedy-color the adjacency graph, most-constrained (highest degree)
+    nodes first. Each node carries a bitmask of the colors its neighbors
+    have taken, updated incrementally as nodes are colored -- so finding
+    the smallest legal color is two int ops and no node ever rescans its
+    neighborhood."""
+    colors = np.full(G.number_of_nodes(), -1, dtype=np.int8)
+    forbidden = [0] * G.number_of_nodes()
+    order = sorted(G.nodes, key=G.degree, reverse=True)
+    full = (1 << n_colors) - 1
+
+    for i in order:
+        free = ~forbidden[i] & full
+        if free:
+            c = (free & -free).bit_length() - 1
+        else:
+            # the neighbors exhaust the palette; wrap deterministically
+            c = i % n_colors
+        colors[i] = c
+        bit = 1 << c
+        for j in G[i]:
+            forbidden[j] |= bit
+
+    return colors
+
+
+def build_adjacency_graph(gdf):
+    """Build a graph over 0..N-1 with an edge wherever two neighborhoods
+    touch. One bulk query against the spatial index returns all
+    intersecting pairs at once -- the R-tree prunes candidates by
+    bounding box and GEOS runs the exact predicate in C, with no
+    per-geometry Python loop at all."""
+    left, right = gdf.sindex.query(gdf.geometry, predicate="intersects")
+    mask = left < right  # drop self-hits and mirrored duplicates
+
+    G = nx.Graph()
+    G.add_nodes_from(range(len(gdf)))
+    G.add_edges_from(zip(left[mask].tolist(), right[mask].tolist()))
+    return G
+
+
 def main(args):
     place = args.place
     placename = place.split(',')[0].replace(" ", "").lower()
@@ -26,7 +84,7 @@ def main(args):
     # get the bounding box of a city from ox
     west, south, east, north = get_bounds(args.place)
 
-    one_mile = lat_lon_dist(one_mile_lat, one_mile_lon(abs(north - south) / 2))
+    one_mile = one_mile_at(north, south)
 
     north += one_mile.y
     south -= one_mile.y
@@ -35,45 +93,98 @@ def main(args):
 
     north, south, east, west = scale(north, south, east, west, target_ratio=1.5)
 
-    G = ox.graph_from_bbox(north, south, east, west, network_type="drive", retain_all=True)
-    gdf_streets = ox.graph_to_gdfs(G, nodes=False, edges=True, node_geometry=False, fill_edge_geometry=True)
-    gdf_streets = gdf_streets.to_crs(common_crs)
-    gdf_streets["color"] = street_color
-
-    # get all water, including lakes, rivers, and oceans, reservoirs, fountains, pools, and man-made lakes and ponds
-    tags = {"natural": ["water", "bay", "strait"]}
-    gdf_water = ox.features.features_from_bbox(north, south, east, west, tags=tags)
-    gdf_water.crs = common_crs
-    # Remove all points from the water data
-    gdf_water = gdf_water[gdf_water.geometry.type.isin(['Polygon', 'MultiPolygon'])]    
-
-    # schools, but just the buildings
-    # tags = {"building": "school", "landuse": "cemetery"}
-    # gdf_buildings = ox.features.features_from_place(place, tags=tags)
-    # gdf_buildings.crs = common_crs
-
-    try:
-        tags = {"leisure": ["park", "garden"]}
-        gdf_park = ox.features.features_from_bbox(north, south, east, west, tags=tags)
-        # remove all elements of type node
-        gdf_park = gdf_park[gdf_park["geometry"].apply(lambda x: x.geom_type != "Point")]
-        gdf_park.crs = common_crs
-    except ox._errors.InsufficientResponseError:
-        gdf_park = None
-
-    try:
-        tags = {'boundaries': "administrative", "admin_level": "10"}
-        gdf_neighborhoods = ox.features.features_from_bbox(north, south, east, west, tags=tags)
-        gdf_neighborhoods.crs = common_crs
-
-        # remove all points 
-        gdf_neighborhoods = gdf_neighborhoods[gdf_neighborhoods["geometry"].apply(lambda x: x.geom_type == "Polygon")]
-
-    except ox._errors.InsufficientResponseError:
-        gdf_neighborhoods = None
-
-    # randomly assign one these colors to each neighborhood
-    random.seed(args.seed)
+    bbox = (north, south, east, west)
+
+    def fetch_streets():
+        # retain_all=False keeps only the largest connected component; the tiny
+        # disconnected subgraphs are noise on a poster and inflate the edge count
+        G = ox.graph_from_bbox(north, south, east, west, network_type="drive", retain_all=False, truncate_by_edge=True)
+        gdf = ox.graph_to_gdfs(G, nodes=False, edges=True, node_geometry=False, fill_edge_geometry=True)
+        # The plot only needs the geometry; drop the ~20 OSM attribute
+        # columns (highway, name, speed, ...) before they hit the cache
+        # and every downstream filter.
+        return align_crs(gdf[["geometry"]], common_crs)
+
+    gdf_streets = cached_features(f"{placename}-streets", (bbox, "drive"), fetch_streets)
+
+    # The feature queries are independent, so overlap their Overpass
+    # round-trips. Unlike baltimore.py they can't be merged into one
+    # request: parks and neighborhoods may not exist for a given city,
+    # and each needs its own fallback.
+    # water: all of it, including lakes, rivers, and oceans, reservoirs,
+    # fountains, pools, and man-made lakes and ponds
+    # schools (just the buildings) would be {"building": "school"}
+    def fetch(name, tags, keep=("geometry",)):
+        # Cache only the columns the layer actually uses, mirroring the
+        # streets path: the raw frames also carry list-typed bookkeeping
+        # columns that Parquet can't store when ways and relations mix.
+        def fetch_features():
+            gdf = ox.features.features_from_bbox(north, south, east, west, tags=tags)
+            return gdf[gdf.columns.intersection(keep)]
+
+        gdf = cached_features(f"{placename}-{name}", (bbox, tags, keep), fetch_features)
+        return gdf.set_crs(common_crs, allow_override=True)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        future_water = pool.submit(fetch, "water", {"natural": ["water", "bay", "strait"]})
+        future_park = pool.submit(fetch, "park", {"leisure": ["park", "garden"]})
+        future_hoods = pool.submit(fetch, "neighborhoods",
+                                   {'boundaries': "administrative", "admin_level": "10"},
+                                   ("name", "geometry"))
+
+        gdf_water = future_water.result()
+        # Remove all points from the water data; only the geometry is
+        # drawn, so drop the tag columns while we're at it
+        gdf_water = gdf_water.loc[gdf_water.geom_type.isin(['Polygon', 'MultiPolygon']), ["geometry"]]
+
+        try:
+            gdf_park = future_park.result()
+            # remove all elements of type node
+            gdf_park = gdf_park.loc[gdf_park.geom_type != "Point", ["geometry"]]
+        except ox._errors.InsufficientResponseError:
+            gdf_park = None
+
+        try:
+            gdf_neighborhoods = future_hoods.result()
+            # remove all points
+            gdf_neighborhoods = gdf_neighborhoods[gdf_neighborhoods.geom_type == "Polygon"]
+        except ox._errors.InsufficientResponseError:
+            gdf_neighborhoods = None
+
+    # Features intersecting the bbox can extend well past it; restrict
+    # them to the plot window (via the spatial index) so matplotlib never
+    # transforms off-canvas vertices.
+    gdf_streets = gdf_streets.cx[west:east, south:north]
+    gdf_water = gdf_water.cx[west:east, south:north]
+    if gdf_park is not None:
+        gdf_park = gdf_park.cx[west:east, south:north]
+
+    # One output pixel in degrees at 24x36" / 300 DPI; vertex detail finer
+    # than this is invisible but matplotlib would still trace it.
+    pixel_tol = (east - west) / (24 * 300)
+    gdf_streets.geometry = gdf_streets.geometry.simplify(pixel_tol, preserve_topology=False)
+    gdf_water.geometry = gdf_water.geometry.simplify(pixel_tol)
+    if gdf_park is not None:
+        gdf_park.geometry = gdf_park.geometry.simplify(pixel_tol)
+    if gdf_neighborhoods is not None:
+        # keep clean shared boundaries between neighborhoods
+        gdf_neighborhoods.geometry = gdf_neighborhoods.geometry.simplify(pixel_tol, preserve_topology=True)
+
+    # assign one of these colors to each neighborhood
+    color_list = city_color_values
+
+    if gdf_neighborhoods is not None:
+        if args.color_method == "constrained":
+            # adjacent neighborhoods get different colors
+            G = build_adjacency_graph(gdf_neighborhoods)
+            colors = assign_colors(G, len(color_list))
+            gdf_neighborhoods["color"] = np.asarray(color_list)[colors]
+        else:
+            # one C-level RNG draw for the whole column, instead of a
+            # Python lambda (and a Series) per row
+            rng = np.random.default_rng(args.seed)
+            idxs = rng.integers(0, len(color_list), size=len(gdf_neighborhoods))
+            gdf_neighborhoods["color"] = np.asarray(color_list)[idxs]
 
     fig, ax = plt.subplots(figsize=(24, 36), dpi=300)
     ax.set_facecolor(bg_color)
@@ -100,11 +211,13 @@ def main(args):
     for spine in ax.spines.values():
         spine.set_visible(False)
 
-    # use a dashed line for the axis grid
-    # gdf_neighborhoods.plot(ax=ax, facecolor=gdf_neighborhoods["color"], linestyle="-", ec="black", linewidth=2, alpha=1)
-    gdf_streets.plot(ax=ax, ec=street_color, linewidth=1.5, alpha=0.5)
+    if gdf_neighborhoods is not None:
+        gdf_neighborhoods.plot(ax=ax, facecolor=gdf_neighborhoods["color"], linestyle="-", ec="none", alpha=0.4)
+    # the dense layers rasterize into one embedded image at save time;
+    # outlines and labels stay vector
+    ax.add_collection(line_collection(gdf_streets.geometry, colors=street_color, linewidths=1.5, alpha=0.5, rasterized=True))
 
-    gdf_water.plot(ax=ax, facecolor=water_blue, linewidth=1.5, alpha=1)
+    gdf_water.plot(ax=ax, facecolor=water_blue, linewidth=1.5, alpha=1, rasterized=True)
 
     if gdf_park is not None:
         gdf_park.plot(ax=ax, facecolor=park_green, alpha=0.6)
@@ -112,24 +225,24 @@ def main(args):
     if gdf_neighborhoods is not None:
         gdf_neighborhoods.plot(ax=ax, facecolor="none", linestyle="-", ec="#AAAAAA", linewidth=2, alpha=0.9, zorder=10)
 
-        for idx, row in gdf_neighborhoods.iterrows():
-            x = row["geometry"].centroid.x + neighborhood_offsets.get(row["name"], (0, 0))[0]
-            y = row["geometry"].centroid.y + neighborhood_offsets.get(row["name"], (0, 0))[1]
+        # representative_point() is guaranteed to fall inside the polygon
+        # (unlike the centroid for non-convex shapes) and is computed in
+        # one vectorized GEOS call.
+        anchors = gdf_neighborhoods.geometry.representative_point()
+        cx = anchors.x.to_numpy()
+        cy = anchors.y.to_numpy()
+        names = gdf_neighborhoods["name"].to_numpy()
+
+        for name, x, y in zip(names, cx, cy):
+            dx, dy = neighborhood_offsets.get(name, ZERO)
 
-            ax.annotate(
-                text=munge(row["name"]),
-                xy=(x, y),
-                horizontalalignment="center",
-                verticalalignment="center",
-                fontsize=6,
-                color="#666666",
-                weight="bold",
-                name="Helvetica",
-                # name="Phosphate",
-                zorder=20,
-            )
+            # ax.text is a plain Text artist; annotate wraps it in an
+            # Annotation with unused xytext/arrow machinery
+            ax.text(x + dx, y + dy, munge(name), **LABEL_KW)
 
-    plt.savefig(f"maps/{placename}_plain.pdf", dpi=300, pad_inches=0.0)
+    # 150 DPI only affects the rasterized street/water layers; vector
+    # content is resolution-independent
+    plt.savefig(f"maps/{placename}_plain.pdf", dpi=150, pad_inches=0.0)
 
 
 if __name__ == "__main__":
@@ -137,6 +250,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("place")
     parser.add_argument("--seed", default=14, type=int, help="Random seed")
+    parser.add_argument("--color-method", choices=["random", "constrained"], default="random",
+                        help="How to color the neighborhoods: at random, or so that no two adjacent ones match")
     args = parser.parse_args()
 
     main(args)
@@ -1,7 +1,17 @@
-import sys
 import math
+import hashlib
+import logging
 
 from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+from matplotlib.collections import LineCollection
+
+log = logging.getLogger(__name__)
 
 lat_lon_dist = namedtuple('lat_lon_dist', ['y', 'x'])
 
@@ -10,12 +20,76 @@ one_mile_lat = 0.01446
 def one_mile_lon(lat):
     return 0.0144927536231884 * math.cos(lat * math.pi / 180)
 
+def one_mile_at(north, south):
+    """One mile in (lat, lon) degrees for a bbox. Every script needs this
+    for the mile grid and the margin math."""
+    return lat_lon_dist(one_mile_lat, one_mile_lon(abs(north - south) / 2))
+
 # one km in latitude, longitude degrees
 one_km = lat_lon_dist(0.008983, 0.0113636)
 
 # Define a common CRS for both GeoDataFrames (replace with your desired CRS)
 common_crs = 'EPSG:4326'
 
+# Downloaded OSM data is cached here as GeoParquet so that repeated runs
+# (e.g., while tuning colors and label placement) don't hit Overpass again.
+cache_dir = Path("cache")
+
+def cache_key(key):
+    """Short stable hash of the query parameters (bbox, tags, ...), so that
+    editing the query invalidates the cache. blake2b lets us ask for the
+    short digest directly instead of computing 20 bytes and slicing."""
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+
+def cached_features(name, key, fetch):
+    """Return the GeoDataFrame produced by fetch(), reading it from the local
+    Parquet cache when possible and writing it there on a cache miss."""
+    path = cache_dir / f"{name}-{cache_key(key)}.parquet"
+    if path.exists():
+        return gpd.read_parquet(path)
+
+    gdf = fetch()
+    # osmnx feature frames keep the raw OSM element ids in list-typed
+    # columns ("nodes" is a flat list for ways but nested for
+    # multipolygon relations), which Arrow refuses to mix in one column.
+    # Nothing downstream reads them, so drop them before writing.
+    gdf = gdf.drop(columns=["nodes", "ways"], errors="ignore")
+    cache_dir.mkdir(exist_ok=True)
+    gdf.to_parquet(path)
+    return gdf
+
+def align_crs(gdf, target):
+    """Reproject to target only if needed. to_crs copies the coordinate
+    arrays even when the CRS already matches, and the OSM fetches usually
+    come back in lat/lon already."""
+    return gdf if gdf.crs == target else gdf.to_crs(target)
+
+def line_collection(geoms, **kwargs):
+    """Turn a GeoSeries of (Multi)LineStrings into a single matplotlib
+    LineCollection: one draw call over a contiguous coordinate array
+    instead of one Path per row, which is what GeoDataFrame.plot does."""
+    parts = shapely.get_parts(np.array(geoms, dtype=object))
+    coords, index = shapely.get_coordinates(parts, return_index=True)
+    segments = np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+    return LineCollection(segments, **kwargs)
+
+def draw_nautical_lines(ax, xmin, xmax, ymin, ymax, dx=0.005, angle=60,
+                        color="#d0dce8", linewidth=0.5, alpha=1):
+    """Draw parallel diagonal lines across the map window, nautical-chart
+    style. The endpoints are generated as stacked NumPy arrays and handed
+    to matplotlib as one (n, 2, 2) LineCollection, so no Python loop runs
+    per line. Returns the collection so callers can set a clip path."""
+    span = ymax - ymin
+    cot = 1 / math.tan(math.radians(angle))
+    n = int(np.ceil((xmax - xmin + 2 * span) / dx)) + 1
+    xs = xmin - span + np.arange(n) * dx
+    starts = np.column_stack([xs, np.full(n, ymin)])
+    ends = np.column_stack([xs + span * cot, np.full(n, ymax)])
+    segments = np.stack([starts, ends], axis=1)
+    lc = LineCollection(segments, colors=color, linewidths=linewidth, alpha=alpha)
+    ax.add_collection(lc)
+    return lc
+
 def rgb_to_hex(r, g, b):
     return f'#{r:02x}{g:02x}{b:02x}'
 
@@ -73,6 +147,13 @@ baltimore_city_colors = {
     "blue": "#a0cce8",
 }
 
+# the palette as a flat sequence, for samplers that index by position
+city_color_values = tuple(baltimore_city_colors.values())
+
+# Shared default for the offset lookups below, so the label loops don't
+# allocate a fresh tuple per miss.
+ZERO = (0.0, 0.0)
+
 neighborhood_offsets = {
     "Holabird Industrial Park": (0, +0.003),
     "Locust Point Industrial Area": (0.001, -0.0035),
@@ -183,7 +264,7 @@ def scale(north, south, east, west, target_ratio=1.5):
         east += compensation / 2
         west -= compensation / 2
 
-    print("Adjusted boundaries:", *map(lambda x: f"{x:.5f}", [west, south, east, north]), file=sys.stderr)
+    log.debug("Adjusted boundaries: %.5f %.5f %.5f %.5f", west, south, east, north)
 
     return north, south, east, west
         